@@ -1,14 +1,9 @@
 import os
-import pandas as pd
-from sqlalchemy import create_engine, text
-from snowflake.sqlalchemy import URL
 from dotenv import load_dotenv
-from modelz import SessionLocal, QueryResult
-from snowflake_utils import query_snowflake, get_schema_details
-from groq_utils import get_groq_response
-from action_utils import parse_action_response, execute_action
 import streamlit as st
-from PIL import Image
+
+# Heavy modules (pandas, SQLAlchemy, Snowflake, Groq) are imported where they are used,
+# so the login page renders without loading them
 
 # Load environment variables
 load_dotenv()
@@ -20,15 +15,29 @@ st.set_page_config(
     layout="wide"
 )
 
+# Static files are read once per server process, not on every rerun
+@st.cache_data
+def read_css(file_name):
+    with open(file_name) as f:
+        return f.read()
+
+@st.cache_data
+def read_bytes(file_name):
+    with open(file_name, "rb") as f:
+        return f.read()
+
 # Custom CSS for styling
 def local_css(file_name):
-    with open(file_name) as f:
-        st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
+    st.markdown(f'<style>{read_css(file_name)}</style>', unsafe_allow_html=True)
 
 local_css("style.css")
 
-# Connect to Snowflake
+# Connect to Snowflake (engine and its connection pool are shared across reruns)
+@st.cache_resource
 def get_snowflake_connection():
+    from sqlalchemy import create_engine
+    from snowflake.sqlalchemy import URL
+
     return create_engine(URL(
         account=os.getenv("SNOWFLAKE_ACCOUNT"),
         user=os.getenv("SNOWFLAKE_USER"),
@@ -39,11 +48,29 @@ def get_snowflake_connection():
         role=os.getenv("SNOWFLAKE_ROLE")
     ))
 
+# Start log retention, precomputed answers, the schema prefetch and the local replica once per server process
+@st.cache_resource
+def start_background_jobs():
+    from modelz import init_db
+    from log_retention import start_retention_worker
+    from precompute_utils import start_precompute_worker
+    from snowflake_utils import prefetch_schema_details
+    from replica_utils import start_replica_worker
+
+    init_db()
+    start_retention_worker()
+    start_precompute_worker()
+    prefetch_schema_details()
+    start_replica_worker()
+    return True
+
 # Authenticate user
 def authenticate_user(email, password):
     if not email.endswith("@ahs.com"):
         return False  # Restrict access to emails ending with @ahc.com
 
+    from sqlalchemy import text
+
     engine = get_snowflake_connection()
     with engine.connect() as conn:
         query = text("SELECT COUNT(*) FROM UserPasswordName WHERE username = :email AND password = :password")
@@ -52,6 +79,8 @@ def authenticate_user(email, password):
 
 # Check if user needs to change password
 def needs_password_change(email):
+    from sqlalchemy import text
+
     engine = get_snowflake_connection()
     with engine.connect() as conn:
         query = text("SELECT initial FROM UserPasswordName WHERE username = :email")
@@ -60,6 +89,8 @@ def needs_password_change(email):
 
 # Update password in Snowflake
 def update_password(email, new_password):
+    from sqlalchemy import text
+
     engine = get_snowflake_connection()
     with engine.connect() as conn:
         query = text("UPDATE UserPasswordName SET password = :new_password, initial = FALSE WHERE username = :email")
@@ -80,6 +111,7 @@ def password_change_page():
                 update_password(email, new_password)
                 st.success("Password changed successfully!")
                 st.session_state["password_changed"] = True
+                st.session_state["needs_password_change"] = False
                 st.rerun()
             else:
                 st.error("New passwords do not match!")
@@ -97,15 +129,28 @@ def login_page():
         if authenticate_user(email, password):
             st.session_state["authenticated"] = True
             st.session_state["user"] = email
+            st.session_state.pop("needs_password_change", None)
             st.rerun()
         else:
             st.error("Invalid credentials! Please try again.")
 
 # Main Application
 def main_app():
+    import pandas as pd
+    from sqlalchemy import create_engine, text, bindparam
+    from snowflake.sqlalchemy import URL
+    from modelz import SessionLocal, QueryResult, engine as local_engine
+    from snowflake_utils import get_cached_schema_details
+    from groq_utils import get_groq_response
+    from action_utils import parse_action_response, execute_action
+    from result_utils import encode_result, decode_result
+    from precompute_utils import lookup_precomputed, cached_query_snowflake
+    from followup_utils import make_query_last_result, describe_cached_results, remember_result
+
+    start_background_jobs()
+
     with st.sidebar:
-        logo = Image.open("logo.png")  # Replace with your logo (500x500px)
-        st.image(logo, width=200)
+        st.image(read_bytes("logo.png"), width=200)  # Replace with your logo (500x500px)
         st.markdown("""
         ❄️ Snowflake Data Assistant
         Powered by Groq & Streamlit
@@ -126,43 +171,68 @@ def main_app():
             st.session_state.total_tokens = 0
         st.metric("Total Tokens Used", st.session_state.total_tokens)
 
+        # Recent query log (results are stored compressed, decode them for display)
+        with st.expander("🧾 Recent Query Log"):
+            if st.checkbox("Show last 5 queries"):
+                db_session = SessionLocal()
+                try:
+                    recent = db_session.query(QueryResult).order_by(QueryResult.id.desc()).limit(5).all()
+                    for row in recent:
+                        decoded = decode_result(row.sfresult)
+                        st.markdown(f"**{row.query}**")
+                        if decoded["row_count"] is None:
+                            st.caption("legacy row")
+                        else:
+                            st.caption(f"{decoded['row_count']} rows" + (" (truncated)" if decoded["truncated"] else ""))
+                        st.write(decoded["rows"])
+                finally:
+                    db_session.close()
+
     # Main chat interface
     st.title("❄️ Snowflake Data Assistant")
     st.caption("Ask natural language questions about your Snowflake data")
 
-    # Get schema details (from main.py)
-    schema_details = get_schema_details()
-    schema_text = "\n".join(
-        [f"Table: {table}, Columns: {', '.join(columns)}" for table, columns in schema_details.items()]
-    )
-
-    # System prompt (from main.py)
-    react_system_prompt = f"""  
-        You are a Snowflake SQL assistant. Use the schema below:    
-        {schema_text}    
-        **STRICT RULES** (Violating these will be considered a failure):  
-        1. Use exact table/column names, valid joins, and correct foreign keys.    
-        2. Handle time queries (DATEADD, DATEDIFF), NULLs, and incomplete data.    
-        3. Ensure Snowflake syntax, proper aggregation (SUM, COUNT), and GROUP BY.    
-        4. Optimize queries, avoid unnecessary joins/subqueries, and use aliases.    
-        5. **NEVER use ORDER BY before UNION. Instead, use ORDER BY inside a subquery with LIMIT, then select from that subquery.**  
-        6. Use DISTINCT only when necessary.    
-        7. Merge multiple queries into one when possible.    
-        8. Respond **only with a JSON object** in the following format(never respond in any other format except json):    
-        {{  
-          "function_name": "query_snowflake",  
-          "function_parms": {{"query": "<Your SQL Query Here>"}}  
-        }}  
-    """
+    # System prompt (from main.py), built from the cached schema only when a question is asked
+    def build_system_prompt():
+        schema_details = get_cached_schema_details()
+        schema_text = "\n".join(
+            [f"Table: {table}, Columns: {', '.join(columns)}" for table, columns in schema_details.items()]
+        )
+        return f"""  
+            You are a Snowflake SQL assistant. Use the schema below:    
+            {schema_text}    
+            **STRICT RULES** (Violating these will be considered a failure):  
+            1. Use exact table/column names, valid joins, and correct foreign keys.    
+            2. Handle time queries (DATEADD, DATEDIFF), NULLs, and incomplete data.    
+            3. Ensure Snowflake syntax, proper aggregation (SUM, COUNT), and GROUP BY.    
+            4. Optimize queries, avoid unnecessary joins/subqueries, and use aliases.    
+            5. **NEVER use ORDER BY before UNION. Instead, use ORDER BY inside a subquery with LIMIT, then select from that subquery.**  
+            6. Use DISTINCT only when necessary.    
+            7. Merge multiple queries into one when possible.    
+            8. Respond **only with a JSON object** in the following format(never respond in any other format except json):    
+            {{  
+              "function_name": "query_snowflake",  
+              "function_parms": {{"query": "<Your SQL Query Here>"}}  
+            }}  
+            9. If a follow-up can be answered from one of the "Cached results" listed with the question (sorting, filtering, top N, totals), respond instead with:    
+            {{  
+              "function_name": "query_last_result",  
+              "function_parms": {{"result_id": <id>, "filters": [{{"column": "<col>", "op": "==|!=|>|>=|<|<=|in|not in|contains|between|year", "value": <value>}}], "group_by": ["<col>"], "aggregations": {{"<col>": "sum|mean|min|max|count|nunique"}}, "sort_by": ["<col>"], "ascending": true, "limit": <n>, "columns": ["<col>"], "query": "<Equivalent SQL, used if the cached result is not enough>"}}  
+            }}  
+            Omit operations you do not need and use only the columns listed for that result.    
+        """
 
     # Available actions (from main.py)
-    available_actions = {"query_snowflake": query_snowflake}
+    if "result_frames" not in st.session_state:
+        st.session_state.result_frames = []  # Last FOLLOWUP_CACHE_SIZE results as DataFrames
+    available_actions = {
+        "query_snowflake": cached_query_snowflake,
+        "query_last_result": make_query_last_result(st.session_state.result_frames, cached_query_snowflake),
+    }
 
     # Function to sync SQLite data to Snowflake (from main.py)
     def sync_sqlite_to_snowflake():
         try:
-            DATABASE_URL = "sqlite:///log.db"
-            local_engine = create_engine(DATABASE_URL)
             table_name = "query_result"
 
             with local_engine.connect() as conn:
@@ -212,12 +282,12 @@ def main_app():
 
                 # Mark rows as synced in SQLite
                 with local_engine.connect() as local_conn:
-                    for id in df['id']:
-                        # Use text() and pass parameters as a dictionary
-                        local_conn.execute(
-                            text(f"UPDATE {table_name} SET synced_to_snowflake = TRUE WHERE id = :id"),
-                            {"id": id}  # Pass parameters as a dictionary
-                        )
+                    # One UPDATE for the whole batch instead of one per row
+                    local_conn.execute(
+                        text(f"UPDATE {table_name} SET synced_to_snowflake = TRUE WHERE id IN :ids")
+                        .bindparams(bindparam("ids", expanding=True)),
+                        {"ids": [int(id) for id in df['id']]}
+                    )
                     local_conn.commit()
 
         except Exception as e:
@@ -232,7 +302,7 @@ def main_app():
             query_result = QueryResult(
                 query=user_query,
                 answer=str(natural_language_response) if natural_language_response else None,
-                sfresult=str(result) if result else None,
+                sfresult=encode_result(result),  # Compressed result with row count and hash
                 sqlquery=str(sql_query) if sql_query else None,
                 raw_response=str(response_text),  # Save raw response
                 tokens_first_call=tokens_first_call,  # Tokens used in the first call
@@ -248,9 +318,9 @@ def main_app():
         finally:
             db_session.close()
 
-    # Initialize chat history
+    # Initialize chat history (the system prompt is added with the first question)
     if "messages" not in st.session_state:
-        st.session_state.messages = [{"role": "system", "content": react_system_prompt}]  # System prompt
+        st.session_state.messages = []
         st.session_state.chat_history = []  # Separate list for chat history (user + assistant messages)
 
     # Display chat messages
@@ -260,6 +330,11 @@ def main_app():
 
     # Chat input
     if prompt := st.chat_input("Ask about your Snowflake data..."):
+        with st.spinner("Loading schema..."):
+            react_system_prompt = build_system_prompt()
+        if not st.session_state.messages:
+            st.session_state.messages.append({"role": "system", "content": react_system_prompt})  # System prompt
+
         # Add user message to chat history
         st.session_state.messages.append({"role": "user", "content": prompt})
         st.session_state.chat_history.append({"role": "user", "content": prompt})
@@ -270,26 +345,46 @@ def main_app():
         # Generate response
         with st.spinner("Analyzing your query..."):
             try:
-                # Get raw response from LLM (First Call)
-                response_text, token_usage_first_call = get_groq_response(react_system_prompt,
-                                                                          st.session_state.messages)
-                st.session_state.total_tokens += token_usage_first_call
-
-                # Parse action from the response
-                action = parse_action_response(response_text)
-                if not action:
-                    raise Exception("Error parsing response.")
-
-                # Execute SQL or any function based on action
-                result = execute_action(action, available_actions)
-                sql_query = action.get("function_parms", {}).get("query", "")
-
-                # Generate natural language response (Second Call)
-                natural_response, token_usage_second_call = get_groq_response(
-                    f"User: {prompt}. Result: {result}. Summarize concisely without assumptions. Use chat history for follow-ups; if unclear, infer the last mentioned entity/metric. Exclude SQL and JSON.",
-                    st.session_state.messages
-                )
-                st.session_state.total_tokens += token_usage_second_call
+                # Popular questions are served from the precomputed results, skipping the SQL-generation call
+                precomputed = lookup_precomputed(prompt)
+                if precomputed:
+                    response_text = f"Precomputed result for: {precomputed['sql']}"
+                    token_usage_first_call = 0
+                    result = precomputed["result"]
+                    sql_query = precomputed["sql"]
+                else:
+                    # Get raw response from LLM (First Call)
+                    response_text, token_usage_first_call = get_groq_response(
+                        f"{react_system_prompt}\n{describe_cached_results(st.session_state.result_frames)}",
+                        st.session_state.messages
+                    )
+                    st.session_state.total_tokens += token_usage_first_call
+
+                    # Parse action from the response
+                    action = parse_action_response(response_text)
+                    if not action:
+                        raise Exception("Error parsing response.")
+
+                    # Execute SQL or any function based on action
+                    result = execute_action(action, available_actions)
+                    sql_query = action.get("function_parms", {}).get("query", "")
+
+                # Keep the result for follow-ups answered locally (never at the cost of this answer)
+                try:
+                    remember_result(st.session_state.result_frames, prompt, sql_query, result)
+                except Exception as e:
+                    print(f"Error caching result for follow-ups: {e}")
+
+                if precomputed and precomputed["answer"]:
+                    # The logged answer still matches the refreshed data
+                    natural_response, token_usage_second_call = precomputed["answer"], 0
+                else:
+                    # Generate natural language response (Second Call)
+                    natural_response, token_usage_second_call = get_groq_response(
+                        f"User: {prompt}. Result: {result}. Summarize concisely without assumptions. Use chat history for follow-ups; if unclear, infer the last mentioned entity/metric. Exclude SQL and JSON.",
+                        st.session_state.messages
+                    )
+                    st.session_state.total_tokens += token_usage_second_call
 
                 # Save query result
                 save_query_result(
@@ -303,6 +398,9 @@ def main_app():
                     total_tokens_used=st.session_state.total_tokens,
                 )
 
+                if precomputed:
+                    natural_response += f"\n\n_Precomputed result, refreshed {precomputed['refreshed_at']:%Y-%m-%d %H:%M} UTC_"
+
                 # Add assistant response to chat history
                 st.session_state.messages.append({"role": "assistant", "content": natural_response})
                 st.session_state.chat_history.append({"role": "assistant", "content": natural_response})
@@ -341,7 +439,10 @@ if "authenticated" not in st.session_state:
     st.session_state["authenticated"] = False
 
 if st.session_state["authenticated"]:
-    if needs_password_change(st.session_state["user"]):
+    # Checked once per login instead of on every rerun
+    if "needs_password_change" not in st.session_state:
+        st.session_state["needs_password_change"] = needs_password_change(st.session_state["user"])
+    if st.session_state["needs_password_change"]:
         password_change_page()
     else:
         main_app()
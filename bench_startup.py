@@ -0,0 +1,57 @@
+# bench_startup.py
+"""Benchmark cold start of app.py: first paint of the login page and a rerun.
+
+Each sample runs the app in a fresh interpreter through Streamlit's AppTest,
+so module imports are paid every time, just like a new server process.
+
+Usage: python bench_startup.py [samples]
+"""
+import json
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ["pandas", "sqlalchemy", "snowflake.connector", "snowflake.sqlalchemy", "PIL", "groq", "modelz"]
+
+_PROBE = r"""
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+
+start = time.perf_counter()
+at = AppTest.from_file("app.py", default_timeout=120)
+at.run()
+first_paint = time.perf_counter() - start
+
+start = time.perf_counter()
+at.run()
+rerun = time.perf_counter() - start
+
+print(json.dumps({
+    "first_paint": first_paint,
+    "rerun": rerun,
+    "title": at.title[0].value if at.title else None,
+    "exception": [e.value for e in at.exception],
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def run_sample():
+    output = subprocess.run([sys.executable, "-c", _PROBE], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = [run_sample() for _ in range(samples)]
+
+    print(f"Login page title: {results[0]['title']}")
+    if results[0]["exception"]:
+        print(f"Exceptions: {results[0]['exception']}")
+    print(f"First paint (median of {samples}): {statistics.median(r['first_paint'] for r in results) * 1000:.0f} ms")
+    print(f"Rerun (median of {samples}): {statistics.median(r['rerun'] for r in results) * 1000:.0f} ms")
+    print(f"Heavy modules loaded on the login page: {', '.join(results[0]['loaded']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
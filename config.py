@@ -9,3 +9,31 @@ SNOWFLAKE_DATABASE = os.getenv("SNOWFLAKE_DATABASE")
 SNOWFLAKE_SCHEMA = os.getenv("SNOWFLAKE_SCHEMA")
 SNOWFLAKE_WAREHOUSE = os.getenv("SNOWFLAKE_WAREHOUSE")
 SNOWFLAKE_ROLE = os.getenv("SNOWFLAKE_ROLE")
+
+# Query result logging: rows kept in the compressed sfresult column (row count and hash cover the full result)
+RESULT_LOG_MAX_ROWS = int(os.getenv("RESULT_LOG_MAX_ROWS", "1000"))
+
+# log.db retention: synced rows older than LOG_RETENTION_DAYS move to gzip archives in LOG_ARCHIVE_DIR
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "30"))
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "log_archive")
+LOG_RETENTION_INTERVAL_SECONDS = int(os.getenv("LOG_RETENTION_INTERVAL_SECONDS", str(6 * 60 * 60)))
+LOG_RETENTION_BATCH_SIZE = int(os.getenv("LOG_RETENTION_BATCH_SIZE", "500"))
+LOG_VACUUM_PAGES = int(os.getenv("LOG_VACUUM_PAGES", "1000"))
+
+# Precomputed answers for the most frequent logged SQL (PRECOMPUTE_TOP_N = 0 disables the job)
+PRECOMPUTE_TOP_N = int(os.getenv("PRECOMPUTE_TOP_N", "20"))
+PRECOMPUTE_WINDOW_DAYS = int(os.getenv("PRECOMPUTE_WINDOW_DAYS", "30"))
+PRECOMPUTE_REFRESH_SECONDS = int(os.getenv("PRECOMPUTE_REFRESH_SECONDS", str(60 * 60)))
+PRECOMPUTE_MAX_STALENESS_SECONDS = int(os.getenv("PRECOMPUTE_MAX_STALENESS_SECONDS", str(2 * 60 * 60)))
+
+# How long the Snowflake schema used in the system prompt is cached
+SCHEMA_CACHE_TTL_SECONDS = int(os.getenv("SCHEMA_CACHE_TTL_SECONDS", str(60 * 60)))
+
+# Optional local SQLite replica of small tables ("*" = every table under REPLICA_MAX_ROWS, empty = disabled)
+REPLICA_TABLES = [t.strip().upper() for t in os.getenv("REPLICA_TABLES", "").split(",") if t.strip()]
+REPLICA_MAX_ROWS = int(os.getenv("REPLICA_MAX_ROWS", "50000"))
+REPLICA_DB_PATH = os.getenv("REPLICA_DB_PATH", "replica.db")
+REPLICA_REFRESH_SECONDS = int(os.getenv("REPLICA_REFRESH_SECONDS", str(15 * 60)))
+
+# Number of previous results per session kept as DataFrames for local follow-up answers
+FOLLOWUP_CACHE_SIZE = int(os.getenv("FOLLOWUP_CACHE_SIZE", "5"))
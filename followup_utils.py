@@ -0,0 +1,221 @@
+# followup_utils.py
+import json
+import time
+from datetime import date
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import pandas as pd
+
+from config import FOLLOWUP_CACHE_SIZE
+from replica_utils import record_query_engine
+
+class FollowUpNotAnswerable(Exception):
+    """The cached result does not contain what the follow-up needs."""
+
+
+def _between(col: pd.Series, value: Any) -> pd.Series:
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise FollowUpNotAnswerable("between needs a [low, high] pair")
+    return col.between(value[0], value[1])
+
+
+def _year(col: pd.Series, value: Any) -> pd.Series:
+    if not pd.api.types.is_datetime64_any_dtype(col):
+        raise FollowUpNotAnswerable(f"year needs a date column, {col.name} is {col.dtype}")
+    return col.dt.year == int(value)
+
+
+_COMPARISONS = {
+    "==": lambda col, value: col == value,
+    "!=": lambda col, value: col != value,
+    ">": lambda col, value: col > value,
+    ">=": lambda col, value: col >= value,
+    "<": lambda col, value: col < value,
+    "<=": lambda col, value: col <= value,
+    "in": lambda col, value: col.isin(value),
+    "not in": lambda col, value: ~col.isin(value),
+    "contains": lambda col, value: col.astype(str).str.contains(str(value), case=False, regex=False, na=False),
+    "between": _between,
+    "year": _year,
+}
+
+_AGGREGATIONS = {"sum", "mean", "min", "max", "count", "nunique"}
+# Computed locally only on float/integer columns, Decimal sums would need the column's scale
+_NUMERIC_AGGREGATIONS = {"sum", "mean"}
+# Filter operations whose value is not compared with the column as is
+_UNCOERCED = {"contains", "year"}
+
+
+def _all_values(col: pd.Series, kind: type) -> bool:
+    values = col.dropna()
+    return col.dtype == object and not values.empty and values.map(lambda v: isinstance(v, kind)).all()
+
+
+def _dtype_name(col: pd.Series) -> str:
+    return "decimal" if _all_values(col, Decimal) else str(col.dtype)
+
+
+def _coerce(col: pd.Series, value: Any) -> Any:
+    """Convert a filter value to the column's type like Snowflake would, or raise FollowUpNotAnswerable."""
+    if isinstance(value, (list, tuple)):
+        return [_coerce(col, item) for item in value]
+    try:
+        if col.dropna().empty:
+            return value  # Nothing to compare with, every comparison is false either way
+        if _all_values(col, Decimal):
+            return Decimal(str(value))
+        if pd.api.types.is_bool_dtype(col):
+            if isinstance(value, bool):
+                return value
+        elif pd.api.types.is_numeric_dtype(col):
+            if not isinstance(value, bool):
+                return pd.to_numeric(value)  # "2024" on an integer column is 2024
+        elif pd.api.types.is_datetime64_any_dtype(col):
+            timestamp = pd.Timestamp(value)
+            if (timestamp.tzinfo is None) == (col.dt.tz is None):
+                return timestamp
+        elif pd.api.types.is_string_dtype(col) and isinstance(value, str):
+            return value
+    except (ArithmeticError, TypeError, ValueError) as e:
+        raise FollowUpNotAnswerable(f"{value!r} is not a valid {col.name} value: {e}")
+    raise FollowUpNotAnswerable(f"{value!r} does not match {col.name} ({_dtype_name(col)})")
+
+
+def _to_frame(rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Build a DataFrame with dates as datetimes, so operations vectorize; Decimals are kept exact."""
+    frame = pd.DataFrame(rows)
+    for column in frame.columns:
+        values = frame[column].dropna()
+        if values.empty or frame[column].dtype != object:
+            continue
+        if values.map(lambda v: isinstance(v, date)).all():
+            try:
+                frame[column] = pd.to_datetime(frame[column])
+            except (ValueError, TypeError):
+                pass  # e.g. TIMESTAMP_TZ values with mixed offsets, left as Python datetimes
+
+    return frame
+
+
+def remember_result(cache: List[Dict[str, Any]], question: str, sql_query: str, result: Any) -> None:
+    """Keep a successful tabular result as a DataFrame, holding only the last FOLLOWUP_CACHE_SIZE."""
+    if not isinstance(result, list) or not result or not all(isinstance(row, dict) for row in result):
+        return
+    if "error" in result[0] or "data" in result[0]:
+        return  # Errors and multi-statement results are not cached
+
+    next_id = cache[-1]["id"] + 1 if cache else 1
+    cache.append({"id": next_id, "question": question, "sql": sql_query, "frame": _to_frame(result)})
+    del cache[:-FOLLOWUP_CACHE_SIZE]
+
+
+def describe_cached_results(cache: List[Dict[str, Any]]) -> str:
+    """Summarize cached results for the LLM prompt (ids, questions, columns, row counts)."""
+    if not cache:
+        return "Cached results: none"
+    lines = ["Cached results:"]
+    for entry in cache:
+        frame = entry["frame"]
+        lines.append(
+            f"- result_id {entry['id']}: \"{entry['question']}\" ({len(frame)} rows) "
+            f"columns: {', '.join(f'{column} ({_dtype_name(frame[column])})' for column in frame.columns)}"
+        )
+    return "\n".join(lines)
+
+
+def _as_list(value: Union[str, List[str], None]) -> List[str]:
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+def apply_operations(frame: pd.DataFrame, filters: Optional[List[Dict[str, Any]]] = None,
+                     group_by: Union[str, List[str], None] = None, aggregations: Optional[Dict[str, str]] = None,
+                     sort_by: Union[str, List[str], None] = None, ascending: Union[bool, List[bool]] = True,
+                     limit: Optional[int] = None, columns: Union[str, List[str], None] = None) -> pd.DataFrame:
+    """Filter, aggregate, sort and trim a cached result with vectorized pandas operations."""
+    def require(names):
+        missing = [name for name in names if name not in frame.columns]
+        if missing:
+            raise FollowUpNotAnswerable(f"columns not in cached result: {', '.join(missing)}")
+
+    if filters:
+        require([f["column"] for f in filters])
+        mask = pd.Series(True, index=frame.index)
+        for f in filters:
+            op = f.get("op", "==")
+            if op not in _COMPARISONS:
+                raise FollowUpNotAnswerable(f"unsupported filter operation: {op}")
+            col = frame[f["column"]]
+            value = f.get("value") if op in _UNCOERCED else _coerce(col, f.get("value"))
+            mask &= _COMPARISONS[op](col, value)
+        frame = frame[mask]
+
+    group_by = _as_list(group_by)
+    if aggregations:
+        require(group_by + list(aggregations))
+        unsupported = set(aggregations.values()) - _AGGREGATIONS
+        if unsupported:
+            raise FollowUpNotAnswerable(f"unsupported aggregation: {', '.join(sorted(unsupported))}")
+        for column, func in aggregations.items():
+            col = frame[column]
+            if func in _NUMERIC_AGGREGATIONS and (
+                    not pd.api.types.is_numeric_dtype(col) or pd.api.types.is_bool_dtype(col)):
+                raise FollowUpNotAnswerable(f"{func} needs a float or integer column, {column} is {_dtype_name(col)}")
+        if group_by:
+            frame = frame.groupby(group_by, as_index=False).agg(aggregations)
+        else:
+            frame = pd.DataFrame([{column: frame[column].agg(func) for column, func in aggregations.items()}])
+    elif group_by:
+        raise FollowUpNotAnswerable("group_by needs aggregations")
+
+    sort_by = _as_list(sort_by)
+    if sort_by:
+        require(sort_by)
+        frame = frame.sort_values(sort_by, ascending=True if ascending is None else ascending)
+
+    if limit is not None:
+        frame = frame.head(int(limit))
+
+    columns = _as_list(columns)
+    if columns:
+        require(columns)
+        frame = frame[columns]
+
+    return frame
+
+
+def _to_records(frame: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Convert a DataFrame back to query_snowflake's list-of-dicts shape with plain Python values."""
+    frame = frame.astype(object).where(frame.notna(), None)
+    return [
+        {column: value.date() if isinstance(value, pd.Timestamp) and value == value.normalize() else value
+         for column, value in row.items()}
+        for row in frame.to_dict(orient="records")
+    ]
+
+
+def make_query_last_result(cache: List[Dict[str, Any]],
+                           fallback: Callable[[str], Any]) -> Callable[..., Any]:
+    """Build the query_last_result action over a session's cached results, falling back to `fallback(query)`."""
+    def query_last_result(result_id: Optional[int] = None, query: Optional[str] = None, **operations) -> Any:
+        start = time.perf_counter()
+        try:
+            entry = next((e for e in reversed(cache) if result_id is None or e["id"] == int(result_id)), None)
+            if entry is None:
+                raise FollowUpNotAnswerable(f"result {result_id} is no longer cached")
+            result = _to_records(apply_operations(entry["frame"], **operations))
+            record_query_engine(
+                query or json.dumps({"result_id": entry["id"], **operations}, default=str),
+                "previous_result",
+                int((time.perf_counter() - start) * 1000),
+            )
+            return result
+        except (FollowUpNotAnswerable, AttributeError, KeyError, TypeError, ValueError) as e:
+            if not query:
+                return [{"error": f"Cannot answer from the previous result: {e}"}]
+            print(f"Follow-up falling back to Snowflake: {e}")
+            return fallback(query)
+
+    return query_last_result
@@ -0,0 +1,164 @@
+# log_retention.py
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any
+
+from sqlalchemy import text
+
+from config import (
+    LOG_RETENTION_DAYS,
+    LOG_ARCHIVE_DIR,
+    LOG_RETENTION_INTERVAL_SECONDS,
+    LOG_RETENTION_BATCH_SIZE,
+    LOG_VACUUM_PAGES,
+)
+from modelz import engine, SessionLocal, QueryResult, QueryEngineAudit, init_db
+
+_worker_lock = threading.Lock()
+_worker_started = False
+
+
+def incremental_vacuum_enabled() -> bool:
+    """Return True if log.db uses INCREMENTAL auto_vacuum (new files do, older ones need converting)."""
+    with engine.connect() as conn:
+        return conn.execute(text("PRAGMA auto_vacuum")).scalar() == 2
+
+
+def convert_to_incremental_vacuum() -> None:
+    """Switch an existing log.db to INCREMENTAL auto_vacuum with one full VACUUM.
+
+    The VACUUM holds the write lock for the whole rebuild, so this is never run by the
+    background worker; run `python log_retention.py --convert-vacuum` while the app is stopped.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if conn.execute(text("PRAGMA auto_vacuum")).scalar() == 2:
+            print("log.db already uses incremental auto_vacuum.")
+            return
+        print("Converting log.db to incremental auto_vacuum (full VACUUM, blocks writers until done).")
+        conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+        conn.execute(text("VACUUM"))
+
+
+def archive_synced_rows(retention_days: int = LOG_RETENTION_DAYS,
+                        batch_size: int = LOG_RETENTION_BATCH_SIZE) -> int:
+    """Move synced rows older than retention_days into a gzip JSONL archive and delete them locally."""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    columns = [column.name for column in QueryResult.__table__.columns]
+
+    archive = None
+    archived = 0
+    try:
+        while True:
+            # Short transaction per batch so the app's writers are never held up for long
+            db_session = SessionLocal()
+            try:
+                rows = (
+                    db_session.query(QueryResult)
+                    .filter(QueryResult.synced_to_snowflake == True, QueryResult.created_at < cutoff)  # noqa: E712
+                    .order_by(QueryResult.id)
+                    .limit(batch_size)
+                    .all()
+                )
+                if not rows:
+                    break
+
+                if archive is None:
+                    # Archive file is only created once there is something to move
+                    os.makedirs(LOG_ARCHIVE_DIR, exist_ok=True)
+                    archive_path = os.path.join(
+                        LOG_ARCHIVE_DIR,
+                        f"query_result_{datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')}_{rows[0].id}.jsonl.gz",
+                    )
+                    archive = gzip.open(archive_path, "at", encoding="utf-8")
+
+                for row in rows:
+                    archive.write(json.dumps({name: getattr(row, name) for name in columns}, default=str) + "\n")
+                archive.flush()
+
+                ids = [row.id for row in rows]
+                db_session.query(QueryResult).filter(QueryResult.id.in_(ids)).delete(synchronize_session=False)
+                db_session.commit()
+                archived += len(ids)
+            finally:
+                db_session.close()
+    finally:
+        if archive is not None:
+            archive.close()
+
+    return archived
+
+
+def prune_query_engine_audit(retention_days: int = LOG_RETENTION_DAYS) -> int:
+    """Delete query engine audit rows older than retention_days (they are local-only and not archived)."""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    db_session = SessionLocal()
+    try:
+        deleted = db_session.query(QueryEngineAudit).filter(QueryEngineAudit.created_at < cutoff) \
+            .delete(synchronize_session=False)
+        db_session.commit()
+        return deleted
+    finally:
+        db_session.close()
+
+
+def incremental_vacuum(pages: int = LOG_VACUUM_PAGES) -> None:
+    """Return up to `pages` free pages to the filesystem without a blocking full VACUUM."""
+    with engine.connect() as conn:
+        conn.execute(text(f"PRAGMA incremental_vacuum({int(pages)})"))
+        conn.commit()
+
+
+def run_retention() -> Dict[str, Any]:
+    """Run one retention pass: archive old synced rows, then reclaim space incrementally."""
+    try:
+        archived = archive_synced_rows()
+        prune_query_engine_audit()
+        incremental_vacuum()
+        if archived:
+            print(f"Archived {archived} synced rows older than {LOG_RETENTION_DAYS} days.")
+        return {"archived": archived}
+    except Exception as e:
+        print(f"Error running log retention: {e}")
+        return {"error": str(e)}
+
+
+def _retention_loop() -> None:
+    try:
+        if not incremental_vacuum_enabled():
+            print("log.db does not use incremental auto_vacuum, archived rows free pages but the file "
+                  "will not shrink. Run `python log_retention.py --convert-vacuum` while the app is stopped.")
+    except Exception as e:
+        print(f"Error checking auto_vacuum mode: {e}")
+    while True:
+        run_retention()
+        time.sleep(LOG_RETENTION_INTERVAL_SECONDS)
+
+
+def start_retention_worker() -> None:
+    """Start the background retention thread once per process."""
+    global _worker_started
+    init_db()
+    with _worker_lock:
+        if _worker_started:
+            return
+        threading.Thread(target=_retention_loop, name="log-retention", daemon=True).start()
+        _worker_started = True
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="log.db retention and compaction")
+    parser.add_argument("--convert-vacuum", action="store_true",
+                        help="one-time full VACUUM to enable incremental auto_vacuum (stop the app first)")
+    args = parser.parse_args()
+
+    init_db()
+    if args.convert_vacuum:
+        convert_to_incremental_vacuum()
+    else:
+        print(run_retention())
@@ -4,16 +4,21 @@ import pandas as pd
 from sqlalchemy import create_engine
 from snowflake.sqlalchemy import URL
 from dotenv import load_dotenv
-from modelz import SessionLocal, QueryResult
-from snowflake_utils import query_snowflake, get_schema_details
+from modelz import SessionLocal, QueryResult, init_db
+from snowflake_utils import get_schema_details
 from groq_utils import get_groq_response
 from action_utils import parse_action_response, execute_action
+from result_utils import encode_result
+from log_retention import start_retention_worker
+from precompute_utils import start_precompute_worker, cached_query_snowflake
+from replica_utils import start_replica_worker
 
 # Load environment variables
 load_dotenv()
+init_db()
 
 # Function to sync SQLite data to Snowflake
-from sqlalchemy import text  # Ensure this import is present
+from sqlalchemy import text, bindparam  # Ensure this import is present
 
 def sync_sqlite_to_snowflake():
     try:
@@ -68,12 +73,12 @@ def sync_sqlite_to_snowflake():
 
             # Mark rows as synced in SQLite
             with local_engine.connect() as local_conn:
-                for id in df['id']:
-                    # Use text() and pass parameters as a dictionary
-                    local_conn.execute(
-                        text(f"UPDATE {table_name} SET synced_to_snowflake = TRUE WHERE id = :id"),
-                        {"id": id}  # Pass parameters as a dictionary
-                    )
+                # One UPDATE for the whole batch instead of one per row
+                local_conn.execute(
+                    text(f"UPDATE {table_name} SET synced_to_snowflake = TRUE WHERE id IN :ids")
+                    .bindparams(bindparam("ids", expanding=True)),
+                    {"ids": [int(id) for id in df['id']]}
+                )
                 local_conn.commit()
 
     except Exception as e:
@@ -103,7 +108,7 @@ react_system_prompt = f"""
     }}
 """
 
-available_actions = {"query_snowflake": query_snowflake}
+available_actions = {"query_snowflake": cached_query_snowflake}
 
 # query_memory = {}
 
@@ -113,7 +118,7 @@ def save_query_result(user_query, natural_language_response, result, sql_query,
         query_result = QueryResult(
             query=user_query,
             answer=str(natural_language_response) if natural_language_response else None,
-            sfresult=str(result) if result else None,
+            sfresult=encode_result(result),  # Compressed result with row count and hash
             sqlquery=str(sql_query) if sql_query else None,
             raw_response=str(response_text),  # Save raw response
             tokens_first_call=tokens_first_call,  # Tokens used in the first call
@@ -131,6 +136,9 @@ def save_query_result(user_query, natural_language_response, result, sql_query,
 
 
 if __name__ == "__main__":
+    start_retention_worker()  # Archive/vacuum log.db in the background
+    start_precompute_worker()  # Serve popular SQL from precomputed results
+    start_replica_worker()  # Serve lookups on small tables from the local replica
     messages = [{"role": "system", "content": react_system_prompt}]
     query_memory = {}  # Ensuring query memory is properly managed
     total_tokens_used = 0  # Initialize a variable to track cumulative token usage
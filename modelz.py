@@ -1,5 +1,5 @@
 # model.py
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Index, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
@@ -9,7 +9,18 @@ from sqlalchemy import Boolean
 DATABASE_URL = "sqlite:///log.db"
 
 # Create the SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, connect_args={"timeout": 30})
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets the retention worker archive/vacuum while the app keeps writing;
+    # INCREMENTAL auto_vacuum only takes effect on new files (log_retention converts old ones)
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.close()
+
 
 # Create a configured "Session" class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -21,6 +32,10 @@ from sqlalchemy import Boolean  # Import Boolean for the new column
 
 class QueryResult(Base):
     __tablename__ = "query_result"
+    __table_args__ = (
+        # Serves the unsynced-row scan and the retention cutoff scan
+        Index("ix_query_result_synced_created", "synced_to_snowflake", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     query = Column(String, nullable=False)
@@ -37,5 +52,41 @@ class QueryResult(Base):
 
 
 
-# Create the database tables
-Base.metadata.create_all(bind=engine)
+class PrecomputedResult(Base):
+    __tablename__ = "precomputed_result"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sql_hash = Column(String, nullable=False, unique=True)  # sha256 of the normalized SQL
+    sqlquery = Column(Text, nullable=False)
+    questions = Column(Text, nullable=True)  # JSON list of normalized questions that produced this SQL
+    sfresult = Column(Text, nullable=True)  # Encoded with result_utils.encode_result
+    answer = Column(Text, nullable=True)  # Logged answer, only kept while the result hash still matches
+    hits = Column(Integer, default=0)  # How often the SQL appeared in the mining window
+    refreshed_at = Column(DateTime, nullable=True)
+
+
+class QueryEngineAudit(Base):
+    __tablename__ = "query_engine_audit"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sqlquery = Column(Text, nullable=False)
+    served_by = Column(String, nullable=False)  # "previous_result", "precomputed", "replica" or "snowflake"
+    fallback_reason = Column(Text, nullable=True)  # Why the replica was not used, if it was tried
+    duration_ms = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+_db_initialized = False
+
+
+def init_db():
+    """Create the database tables (once per process, kept off import so startup stays cheap)."""
+    global _db_initialized
+    if _db_initialized:
+        return
+    Base.metadata.create_all(bind=engine)
+
+    # create_all skips indexes on tables that already exist, add any missing ones
+    for index in QueryResult.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    _db_initialized = True
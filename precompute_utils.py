@@ -0,0 +1,238 @@
+# precompute_utils.py
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from config import (
+    PRECOMPUTE_TOP_N,
+    PRECOMPUTE_WINDOW_DAYS,
+    PRECOMPUTE_REFRESH_SECONDS,
+    PRECOMPUTE_MAX_STALENESS_SECONDS,
+)
+from modelz import SessionLocal, QueryResult, PrecomputedResult, init_db
+from result_utils import encode_result, decode_result, result_hash
+from snowflake_utils import query_snowflake
+from replica_utils import route_query, record_query_engine, read_only_reason
+
+# In-memory copy of precomputed_result, keyed by SQL hash, plus a normalized question -> SQL hash map
+_cache: Dict[str, Dict[str, Any]] = {}
+_questions: Dict[str, str] = {}
+_cache_lock = threading.Lock()
+_worker_lock = threading.Lock()
+_worker_started = False
+
+# String literals and double-quoted (case-sensitive) identifiers are kept as written
+_QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+# Questions using these words depend on the conversation, so they are never answered from the cache
+_CONTEXT_WORDS = {"he", "she", "it", "they", "them", "his", "her", "their", "its",
+                  "that", "this", "those", "these", "same", "previous", "above", "then", "also"}
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace and uppercase everything except string literals and quoted identifiers."""
+    parts = _QUOTED.split(sql.strip().rstrip(";").strip())
+    return "".join(
+        part if i % 2 else re.sub(r"\s+", " ", part).upper()
+        for i, part in enumerate(parts)
+    ).strip()
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip("?.! ")
+
+
+def sql_hash(sql: str) -> str:
+    return hashlib.sha256(normalize_sql(sql).encode("utf-8")).hexdigest()
+
+
+def mine_popular_sql(top_n: int = PRECOMPUTE_TOP_N,
+                     window_days: int = PRECOMPUTE_WINDOW_DAYS) -> List[Dict[str, Any]]:
+    """Return the most frequent successful SQL in the query log, with the questions that produced it."""
+    since = datetime.utcnow() - timedelta(days=window_days)
+    db_session = SessionLocal()
+    try:
+        # Count on the small columns only, results are fetched for the winners below
+        rows = (
+            db_session.query(QueryResult.id, QueryResult.query, QueryResult.sqlquery)
+            .filter(QueryResult.created_at >= since,
+                    QueryResult.sqlquery.isnot(None),
+                    QueryResult.error_message.is_(None))
+            .order_by(QueryResult.id)
+            .all()
+        )
+
+        counts = Counter()
+        latest = {}
+        questions = defaultdict(set)
+        question_sql = defaultdict(set)
+        for row_id, question, sql in rows:
+            if read_only_reason(sql):
+                continue  # Only read-only SQL is ever replayed on the warehouse
+            key = sql_hash(sql)
+            counts[key] += 1
+            latest[key] = (row_id, sql)  # Rows are in id order
+            question = normalize_question(question)
+            questions[key].add(question)
+            question_sql[question].add(key)
+
+        top = counts.most_common(top_n)
+        logged = {
+            row_id: (sfresult, answer)
+            for row_id, sfresult, answer in
+            db_session.query(QueryResult.id, QueryResult.sfresult, QueryResult.answer)
+            .filter(QueryResult.id.in_([latest[key][0] for key, _ in top]))
+        }
+    finally:
+        db_session.close()
+
+    # A question is only mapped to SQL when it is self-contained and always produced the same SQL
+    def servable(question):
+        return len(question_sql[question]) == 1 and not _CONTEXT_WORDS.intersection(question.split())
+
+    popular = []
+    for key, hits in top:
+        row_id, sql = latest[key]
+        sfresult, answer = logged.get(row_id, (None, None))
+        popular.append({
+            "sql_hash": key, "hits": hits, "sql": sql, "sfresult": sfresult, "answer": answer,
+            "questions": sorted(q for q in questions[key] if servable(q)),
+        })
+    return popular
+
+
+def refresh_precomputed() -> int:
+    """Re-run the popular SQL on Snowflake and store the results; returns how many were refreshed."""
+    refreshed = 0
+    popular = mine_popular_sql()
+    for entry in popular:
+        result = query_snowflake(entry["sql"])
+        if not result or (isinstance(result, list) and isinstance(result[0], dict) and "error" in result[0]):
+            continue
+
+        try:
+            # Stored with Snowflake types and column order, so served rows match query_snowflake's
+            encoded = encode_result(result, typed=True)
+        except TypeError as e:
+            print(f"Not precomputing {entry['sql_hash']}: {e}")
+            continue
+        if decode_result(encoded)["truncated"]:
+            continue  # Only whole results are served
+
+        # The logged answer is still valid if the data behind it has not changed
+        answer = entry["answer"] if result_hash(entry["sfresult"]) == result_hash(encoded) else None
+
+        db_session = SessionLocal()
+        try:
+            row = db_session.query(PrecomputedResult).filter_by(sql_hash=entry["sql_hash"]).first()
+            if row is None:
+                row = PrecomputedResult(sql_hash=entry["sql_hash"])
+                db_session.add(row)
+            row.sqlquery = entry["sql"]
+            row.questions = json.dumps(entry["questions"])
+            row.sfresult = encoded
+            row.answer = answer
+            row.hits = entry["hits"]
+            row.refreshed_at = datetime.utcnow()
+            db_session.commit()
+            refreshed += 1
+        finally:
+            db_session.close()
+
+    # Drop SQL that fell out of the top N so the table and the question map stay bounded
+    db_session = SessionLocal()
+    try:
+        db_session.query(PrecomputedResult) \
+            .filter(PrecomputedResult.sql_hash.notin_([entry["sql_hash"] for entry in popular])) \
+            .delete(synchronize_session=False)
+        db_session.commit()
+    finally:
+        db_session.close()
+
+    load_precomputed()
+    return refreshed
+
+
+def load_precomputed() -> None:
+    """Load stored precomputed results into memory so lookups never touch the database."""
+    db_session = SessionLocal()
+    try:
+        rows = db_session.query(PrecomputedResult).filter(PrecomputedResult.refreshed_at.isnot(None)).all()
+        cache = {}
+        questions = {}
+        for row in rows:
+            decoded = decode_result(row.sfresult)
+            if read_only_reason(row.sqlquery) or not decoded["typed"]:
+                continue  # Rows stored without types are replaced on the next refresh
+            cache[row.sql_hash] = {
+                "sql": row.sqlquery,
+                "result": decoded["rows"],
+                "answer": row.answer,
+                "refreshed_at": row.refreshed_at,
+            }
+            for question in json.loads(row.questions or "[]"):
+                questions[question] = row.sql_hash
+    finally:
+        db_session.close()
+
+    global _cache, _questions
+    with _cache_lock:
+        _cache, _questions = cache, questions
+
+
+def _fresh(entry: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if entry is None:
+        return None
+    age = (datetime.utcnow() - entry["refreshed_at"]).total_seconds()
+    return entry if age <= PRECOMPUTE_MAX_STALENESS_SECONDS else None
+
+
+def lookup_precomputed(question: str) -> Optional[Dict[str, Any]]:
+    """Return a fresh precomputed entry (sql, result, answer, refreshed_at) for a question, if any."""
+    with _cache_lock:
+        key = _questions.get(normalize_question(question))
+        return _fresh(_cache.get(key)) if key else None
+
+
+def cached_query_snowflake(query: str) -> List[Dict[str, Any]]:
+    """query_snowflake that serves fresh precomputed results, then the local replica, before the warehouse."""
+    entry = None
+    if read_only_reason(query) is None:
+        with _cache_lock:
+            entry = _fresh(_cache.get(sql_hash(query)))
+    if entry is not None:
+        record_query_engine(query, "precomputed", 0)
+        return entry["result"]
+    return route_query(query)
+
+
+def _precompute_loop() -> None:
+    while True:
+        try:
+            refreshed = refresh_precomputed()
+            print(f"Refreshed {refreshed} precomputed results.")
+        except Exception as e:
+            print(f"Error refreshing precomputed results: {e}")
+        time.sleep(PRECOMPUTE_REFRESH_SECONDS)
+
+
+def start_precompute_worker() -> None:
+    """Serve stored results immediately and refresh them in a background thread (once per process)."""
+    global _worker_started
+    if PRECOMPUTE_TOP_N <= 0:
+        return
+    with _worker_lock:
+        if _worker_started:
+            return
+        init_db()
+        try:
+            load_precomputed()
+        except Exception as e:
+            print(f"Error loading precomputed results: {e}")
+        threading.Thread(target=_precompute_loop, name="precompute", daemon=True).start()
+        _worker_started = True
@@ -0,0 +1,405 @@
+# replica_utils.py
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Set
+
+import snowflake.connector
+
+from config import REPLICA_TABLES, REPLICA_MAX_ROWS, REPLICA_DB_PATH, REPLICA_REFRESH_SECONDS
+from modelz import SessionLocal, QueryEngineAudit, init_db
+from snowflake_utils import query_snowflake, get_cached_schema_details
+
+# Tables currently present in the replica and their columns whose Snowflake type SQLite
+# does not share (column -> kind), kept in memory so routing never opens the database
+_replicated: Set[str] = set()
+_typed_columns: Dict[str, Dict[str, str]] = {}
+_replicated_lock = threading.Lock()
+_worker_lock = threading.Lock()
+_worker_started = False
+
+# Bumped when the stored representation changes, so older copies are recopied
+_REPLICA_FORMAT = "3"
+
+# Snowflake cursor.description type codes -> (SQLite column affinity, kind of value to restore)
+_SNOWFLAKE_TYPES = {
+    0: ("INTEGER", None),  # FIXED with scale 0; scaled FIXED is handled in _column_type
+    1: ("REAL", None),
+    2: ("TEXT", None),
+    3: ("TEXT", "date"),
+    4: ("TEXT", "timestamp"),
+    5: ("TEXT", "variant"),
+    6: ("TEXT", "timestamp"),
+    7: ("TEXT", "timestamp"),
+    8: ("TEXT", "timestamp"),
+    9: ("TEXT", "variant"),
+    10: ("TEXT", "variant"),
+    11: ("BLOB", "binary"),
+    12: ("TEXT", "time"),
+    13: ("INTEGER", "boolean"),
+}
+# Convert stored values of each kind back to what query_snowflake returns
+_RESTORE = {
+    "fixed": Decimal,
+    "date": date.fromisoformat,
+    "timestamp": datetime.fromisoformat,
+    "time": dt_time.fromisoformat,
+    "boolean": bool,
+}
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_QUOTED_IDENTIFIER = re.compile(r'"')
+_TABLE_REFERENCE = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][\w$.]*)", re.IGNORECASE)
+_IDENTIFIER = re.compile(r"[A-Za-z_][\w$]*")
+_ORDER_BY = re.compile(r"\bORDER\s+BY\b", re.IGNORECASE)
+_ORDER_BY_END = re.compile(r"\b(LIMIT|OFFSET|FETCH|QUALIFY|UNION|EXCEPT|INTERSECT|MINUS)\b", re.IGNORECASE)
+_NULLS_ORDER = re.compile(r"\bNULLS\s+(FIRST|LAST)\s*$", re.IGNORECASE)
+_CTE_NAME = re.compile(r"\b([A-Za-z_][\w$]*)\s+AS\s*\(", re.IGNORECASE)
+_WRITE_KEYWORDS = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|CREATE|DROP|ALTER|TRUNCATE|COPY|GRANT|REVOKE|CALL|PUT|USE|SET)\b",
+    re.IGNORECASE,
+)
+# Operators whose result differs between SQLite and Snowflake (integer division truncates in SQLite)
+_NOT_REPLICABLE = re.compile(r"/")
+
+
+def _connect_replica(read_only: bool = True) -> sqlite3.Connection:
+    if read_only:
+        conn = sqlite3.connect(f"file:{REPLICA_DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        # Autocommit mode, writers open explicit transactions so DDL is covered too
+        conn = sqlite3.connect(REPLICA_DB_PATH, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+    # Snowflake LIKE is case-sensitive, SQLite's is not by default
+    conn.execute("PRAGMA case_sensitive_like = ON")
+    return conn
+
+
+def _column_type(desc) -> tuple:
+    """Return (SQLite affinity, kind) for a Snowflake cursor.description entry."""
+    if desc[1] == 0 and len(desc) > 5 and (desc[5] or 0) > 0:
+        return "TEXT", "fixed"  # NUMBER with a scale comes back as Decimal
+    return _SNOWFLAKE_TYPES.get(desc[1], ("", "variant"))
+
+
+def _value_kind(value: Any) -> Optional[str]:
+    if isinstance(value, Decimal):
+        return "fixed"
+    if isinstance(value, datetime):
+        return "timestamp"
+    if isinstance(value, date):
+        return "date"
+    if isinstance(value, dt_time):
+        return "time"
+    if isinstance(value, bool):
+        return "boolean"
+    return None
+
+
+def _to_sqlite(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return str(value)  # Stored losslessly; queries touching these columns go to Snowflake
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    return value
+
+
+def referenced_tables(query: str) -> Set[str]:
+    """Return the (uppercased, possibly qualified) tables a query reads from, excluding CTE names."""
+    stripped = _STRING_LITERAL.sub("''", query)
+    ctes = {name.upper() for name in _CTE_NAME.findall(stripped)}
+    tables = {name.upper() for name in _TABLE_REFERENCE.findall(stripped)}
+    return tables - ctes
+
+
+def _order_by_keys(query: str) -> List[str]:
+    """Return every sort key of every ORDER BY clause (including window clauses)."""
+    keys = []
+    for match in _ORDER_BY.finditer(query):
+        depth = 0
+        key_start = position = match.end()
+        while position < len(query):
+            char = query[position]
+            if char == "(":
+                depth += 1
+            elif char == ")":
+                if depth == 0:
+                    break
+                depth -= 1
+            elif char == "," and depth == 0:
+                keys.append(query[key_start:position].strip())
+                key_start = position + 1
+            elif depth == 0 and _ORDER_BY_END.match(query, position) and not query[position - 1].isalnum():
+                break
+            position += 1
+        keys.append(query[key_start:position].strip())
+    return keys
+
+
+def read_only_reason(query: str) -> Optional[str]:
+    """Return None for a single read-only SELECT/WITH statement, otherwise the reason it is not one."""
+    stripped = _STRING_LITERAL.sub("''", query).strip().rstrip(";").strip()
+    if ";" in stripped:
+        return "multiple statements"
+    if not re.match(r"(SELECT|WITH)\b", stripped, re.IGNORECASE) or _WRITE_KEYWORDS.search(stripped):
+        return "not a read-only query"
+    return None
+
+
+def replica_eligible(query: str) -> Optional[str]:
+    """Return None if the query can run on the replica, otherwise the reason it cannot."""
+    reason = read_only_reason(query)
+    if reason:
+        return reason
+    stripped = _STRING_LITERAL.sub("''", query).strip().rstrip(";").strip()
+    if _NOT_REPLICABLE.search(stripped):
+        return "statement or operator not supported on the replica"
+    # Result columns are uppercased like Snowflake's unquoted names, so quoted identifiers
+    # (case-sensitive tables, columns and aliases) are left to Snowflake
+    if _QUOTED_IDENTIFIER.search(stripped):
+        return "quoted identifier"
+
+    # SQLite sorts NULLs first for ASC and last for DESC, the opposite of Snowflake
+    if any(not _NULLS_ORDER.search(key) for key in _order_by_keys(stripped)):
+        return "ORDER BY without explicit NULLS FIRST/LAST"
+
+    tables = referenced_tables(stripped)
+    if any("." in table for table in tables):
+        return "qualified table reference"
+    if not tables:
+        return "no tables referenced"
+    with _replicated_lock:
+        missing = tables - _replicated
+        typed = set().union(*(_typed_columns.get(table, {}) for table in tables))
+    if missing:
+        return f"tables not replicated: {', '.join(sorted(missing))}"
+
+    # Fixed-point, date/time, boolean and semi-structured values do not compare or compute
+    # like Snowflake's in SQLite, so any query naming such a column goes to Snowflake
+    used = {name.upper() for name in _IDENTIFIER.findall(stripped)} & typed
+    if used:
+        return f"columns typed differently in SQLite: {', '.join(sorted(used))}"
+    return None
+
+
+def query_replica(query: str) -> List[Dict[str, Any]]:
+    """Run a read-only query on the local replica, shaped like query_snowflake's result."""
+    conn = _connect_replica()
+    try:
+        cursor = conn.execute(query.strip().rstrip(";"))
+        # Queries with quoted identifiers go to Snowflake, so every name here is an unquoted one,
+        # which Snowflake returns uppercased
+        column_names = [desc[0].upper() for desc in cursor.description]
+        rows = [dict(zip(column_names, row)) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+    # Only SELECT * can return typed columns (named ones are routed to Snowflake), restore their values
+    with _replicated_lock:
+        typed = {}
+        for table in referenced_tables(query):
+            typed.update(_typed_columns.get(table, {}))
+    restore = {column: _RESTORE[kind] for column, kind in typed.items() if kind in _RESTORE}
+    for row in rows:
+        for column in restore.keys() & row.keys():
+            if row[column] is not None:
+                row[column] = restore[column](row[column])
+    return rows
+
+
+def record_query_engine(query: str, served_by: str, duration_ms: Optional[int] = None,
+                        fallback_reason: Optional[str] = None) -> None:
+    """Audit which engine served a query."""
+    db_session = SessionLocal()
+    try:
+        db_session.add(QueryEngineAudit(sqlquery=query, served_by=served_by,
+                                        duration_ms=duration_ms, fallback_reason=fallback_reason))
+        db_session.commit()
+    except Exception as e:
+        print(f"Error recording query engine audit: {e}")
+    finally:
+        db_session.close()
+
+
+def route_query(query: str) -> List[Dict[str, Any]]:
+    """Serve eligible read-only queries from the replica, everything else (or any failure) from Snowflake."""
+    start = time.perf_counter()
+    reason = replica_eligible(query) if REPLICA_TABLES else None
+    if REPLICA_TABLES and reason is None:
+        try:
+            result = query_replica(query)
+            record_query_engine(query, "replica", int((time.perf_counter() - start) * 1000))
+            return result
+        except Exception as e:
+            reason = f"replica error: {e}"
+            start = time.perf_counter()
+
+    result = query_snowflake(query)
+    record_query_engine(query, "snowflake", int((time.perf_counter() - start) * 1000), reason)
+    return result
+
+
+def _fetch_table_metadata(cursor, tables: List[str]) -> Dict[str, Dict[str, Any]]:
+    placeholders = ", ".join(["%s"] * len(tables))
+    cursor.execute(
+        "SELECT TABLE_NAME, ROW_COUNT, LAST_ALTERED FROM INFORMATION_SCHEMA.TABLES "
+        f"WHERE TABLE_SCHEMA = CURRENT_SCHEMA() AND TABLE_NAME IN ({placeholders})",
+        tables,
+    )
+    return {row[0]: {"row_count": row[1], "last_altered": str(row[2])} for row in cursor.fetchall()}
+
+
+def _copy_table(cursor, replica: sqlite3.Connection, table: str, last_altered: str) -> None:
+    cursor.execute(f"SELECT * FROM {table}")
+    column_names = [desc[0] for desc in cursor.description]
+    # Declare affinities so literals are converted like Snowflake does (WHERE ID = '1')
+    column_types = [_column_type(desc) for desc in cursor.description]
+    kinds = {name: kind for name, (_, kind) in zip(column_names, column_types) if kind}
+    column_list = ", ".join(f'"{name}" {affinity}'.rstrip() for name, (affinity, _) in zip(column_names, column_types))
+    placeholders = ", ".join(["?"] * len(column_names))
+
+    # Load into a staging table and swap it in, so readers always see a complete copy
+    with replica:
+        replica.execute("BEGIN")
+        replica.execute(f'DROP TABLE IF EXISTS "{table}__staging"')
+        replica.execute(f'CREATE TABLE "{table}__staging" ({column_list})')
+        while True:
+            rows = cursor.fetchmany(5000)
+            if not rows:
+                break
+            for name, value in zip(column_names, rows[0]):
+                if _value_kind(value):
+                    kinds.setdefault(name, _value_kind(value))
+            replica.executemany(
+                f'INSERT INTO "{table}__staging" VALUES ({placeholders})',
+                [tuple(_to_sqlite(value) for value in row) for row in rows],
+            )
+        replica.execute(f'DROP TABLE IF EXISTS "{table}"')
+        replica.execute(f'ALTER TABLE "{table}__staging" RENAME TO "{table}"')
+        replica.execute(
+            "INSERT OR REPLACE INTO _replica_meta (table_name, last_altered, refreshed_at) VALUES (?, ?, ?)",
+            (table, f"{_REPLICA_FORMAT}:{last_altered}", datetime.utcnow().isoformat(sep=" ")),
+        )
+        replica.execute("DELETE FROM _replica_column_kind WHERE table_name = ?", (table,))
+        replica.executemany(
+            "INSERT INTO _replica_column_kind (table_name, column_name, kind) VALUES (?, ?, ?)",
+            [(table, column.upper(), kind) for column, kind in sorted(kinds.items()) if kind],
+        )
+
+
+def _drop_table(replica: sqlite3.Connection, table: str) -> None:
+    with replica:
+        replica.execute("BEGIN")
+        replica.execute(f'DROP TABLE IF EXISTS "{table}"')
+        replica.execute("DELETE FROM _replica_meta WHERE table_name = ?", (table,))
+        replica.execute("DELETE FROM _replica_column_kind WHERE table_name = ?", (table,))
+
+
+def load_replicated_tables() -> None:
+    """Load the list of replicated tables into memory."""
+    global _replicated, _typed_columns
+    if not os.path.exists(REPLICA_DB_PATH):
+        return
+    conn = _connect_replica()
+    tables = set()
+    typed_columns = {}
+    try:
+        # Copies made in an older format are not served until they are recopied
+        tables = {row[0] for row in conn.execute("SELECT table_name, last_altered FROM _replica_meta")
+                  if str(row[1]).startswith(f"{_REPLICA_FORMAT}:")}
+        for table, column, kind in conn.execute("SELECT table_name, column_name, kind FROM _replica_column_kind"):
+            typed_columns.setdefault(table, {})[column] = kind
+    except sqlite3.OperationalError:
+        tables = set()
+    finally:
+        conn.close()
+    with _replicated_lock:
+        _replicated = tables
+        _typed_columns = typed_columns
+
+
+def refresh_replica() -> Dict[str, int]:
+    """Copy selected small tables from Snowflake, skipping tables unchanged since the last copy."""
+    schema_details = get_cached_schema_details()
+    if "error" in schema_details:
+        raise RuntimeError(schema_details["error"])
+
+    candidates = list(schema_details) if REPLICA_TABLES == ["*"] else \
+        [table for table in schema_details if table.upper() in REPLICA_TABLES]
+    stats = {"copied": 0, "unchanged": 0, "skipped": 0}
+    if not candidates:
+        return stats
+
+    replica = _connect_replica(read_only=False)
+    conn = None
+    cursor = None
+    try:
+        replica.execute(
+            "CREATE TABLE IF NOT EXISTS _replica_meta (table_name TEXT PRIMARY KEY, last_altered TEXT, refreshed_at TEXT)"
+        )
+        replica.execute("DROP TABLE IF EXISTS _replica_fixed_point")  # Replaced by _replica_column_kind
+        replica.execute(
+            "CREATE TABLE IF NOT EXISTS _replica_column_kind (table_name TEXT, column_name TEXT, kind TEXT)"
+        )
+        known = dict(replica.execute("SELECT table_name, last_altered FROM _replica_meta").fetchall())
+        for table in set(known) - set(candidates):
+            _drop_table(replica, table)  # No longer selected for replication
+
+        conn = snowflake.connector.connect(
+            user=os.getenv("SNOWFLAKE_USER"),
+            password=os.getenv("SNOWFLAKE_PASSWORD"),
+            account=os.getenv("SNOWFLAKE_ACCOUNT"),
+            warehouse="COMPUTE_WH",
+            database="PRODUCTS",
+            schema="PRODUCT",
+        )
+        cursor = conn.cursor()
+        metadata = _fetch_table_metadata(cursor, candidates)
+
+        for table in candidates:
+            meta = metadata.get(table)
+            if meta is None or meta["row_count"] is None or meta["row_count"] > REPLICA_MAX_ROWS:
+                _drop_table(replica, table)  # Views, missing or too-large tables stay on Snowflake
+                stats["skipped"] += 1
+            elif known.get(table) == f"{_REPLICA_FORMAT}:{meta['last_altered']}":
+                stats["unchanged"] += 1
+            else:
+                _copy_table(cursor, replica, table, meta["last_altered"])
+                stats["copied"] += 1
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+        replica.close()
+
+    load_replicated_tables()
+    return stats
+
+
+def _replica_loop() -> None:
+    while True:
+        try:
+            stats = refresh_replica()
+            print(f"Replica refresh: {stats}")
+        except Exception as e:
+            print(f"Error refreshing local replica: {e}")
+        time.sleep(REPLICA_REFRESH_SECONDS)
+
+
+def start_replica_worker() -> None:
+    """Serve the existing replica immediately and keep it refreshed in a background thread (once per process)."""
+    global _worker_started
+    if not REPLICA_TABLES:
+        return
+    with _worker_lock:
+        if _worker_started:
+            return
+        init_db()
+        load_replicated_tables()
+        threading.Thread(target=_replica_loop, name="replica-refresh", daemon=True).start()
+        _worker_started = True
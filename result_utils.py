@@ -0,0 +1,109 @@
+# result_utils.py
+import base64
+import hashlib
+import json
+import zlib
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Dict, Optional
+
+from config import RESULT_LOG_MAX_ROWS
+
+# Prefix marking an encoded result; plain text in sfresult is a legacy str(result) row
+RESULT_FORMAT = "zjson1"
+# Prefix of results encoded with their Snowflake types, for results that are served again
+TYPED_RESULT_FORMAT = "ztyped1"
+_PREFIXES = (f"{RESULT_FORMAT}:", f"{TYPED_RESULT_FORMAT}:")
+
+
+def _to_json(value: Any, sort_keys: bool = False) -> str:
+    """Serialize a result compactly (Decimal, dates, etc. fall back to str)."""
+    return json.dumps(value, default=str, sort_keys=sort_keys, separators=(",", ":"))
+
+
+def _tag_value(value: Any) -> Dict[str, str]:
+    """JSON default for typed results: tag Snowflake values JSON cannot hold so they can be restored."""
+    if isinstance(value, Decimal):
+        return {"__type__": "decimal", "value": str(value)}
+    if isinstance(value, datetime):
+        return {"__type__": "datetime", "value": value.isoformat()}
+    if isinstance(value, date):
+        return {"__type__": "date", "value": value.isoformat()}
+    if isinstance(value, time):
+        return {"__type__": "time", "value": value.isoformat()}
+    if isinstance(value, (bytes, bytearray)):
+        return {"__type__": "bytes", "value": bytes(value).hex()}
+    raise TypeError(f"cannot encode {type(value).__name__} with its type")
+
+
+_UNTAG = {
+    "decimal": Decimal,
+    "datetime": datetime.fromisoformat,
+    "date": date.fromisoformat,
+    "time": time.fromisoformat,
+    "bytes": bytes.fromhex,
+}
+
+
+def _untag_value(obj: Dict[str, Any]) -> Any:
+    if obj.keys() == {"__type__", "value"} and obj["__type__"] in _UNTAG:
+        return _UNTAG[obj["__type__"]](obj["value"])
+    return obj
+
+
+def encode_result(result: Any, max_rows: int = RESULT_LOG_MAX_ROWS, typed: bool = False) -> Optional[str]:
+    """Encode a query result as compact text for the sfresult column.
+
+    Format: zjson1:<row count>:<sha256 of full result>:<base64 zlib JSON of first max_rows rows>.
+    The text is stored once at write time and synced to Snowflake as is. With typed=True
+    the prefix is ztyped1 and Decimal, date, datetime, time and bytes values are tagged so
+    decode_result returns them as they came from Snowflake (TypeError for other types).
+    """
+    if not result:
+        return None
+
+    # Keys are sorted only for the hash, the stored rows keep Snowflake's column order
+    content_hash = hashlib.sha256(_to_json(result, sort_keys=True).encode("utf-8")).hexdigest()
+
+    if isinstance(result, list):
+        row_count = len(result)
+        rows = result[:max_rows] if row_count > max_rows else result
+    else:
+        row_count = 1
+        rows = result
+
+    if typed:
+        payload = json.dumps(rows, default=_tag_value, separators=(",", ":"))
+    else:
+        payload = _to_json(rows)
+
+    blob = base64.b64encode(zlib.compress(payload.encode("utf-8"), 6)).decode("ascii")
+    return f"{TYPED_RESULT_FORMAT if typed else RESULT_FORMAT}:{row_count}:{content_hash}:{blob}"
+
+
+def decode_result(sfresult: Optional[str]) -> Dict[str, Any]:
+    """Decode an sfresult value written by encode_result (or a legacy str(result) row).
+
+    "typed" is True only when the rows carry their original Snowflake types.
+    """
+    if not sfresult:
+        return {"rows": None, "row_count": 0, "hash": None, "truncated": False, "typed": False}
+
+    if not sfresult.startswith(_PREFIXES):
+        # Legacy rows stored the Python repr, return it untouched
+        return {"rows": sfresult, "row_count": None, "hash": None, "truncated": False, "typed": False}
+
+    prefix, row_count, content_hash, blob = sfresult.split(":", 3)
+    typed = prefix == TYPED_RESULT_FORMAT
+    rows = json.loads(zlib.decompress(base64.b64decode(blob)).decode("utf-8"),
+                      object_hook=_untag_value if typed else None)
+    row_count = int(row_count)
+    truncated = isinstance(rows, list) and len(rows) < row_count
+    return {"rows": rows, "row_count": row_count, "hash": content_hash, "truncated": truncated, "typed": typed}
+
+
+def result_hash(sfresult: Optional[str]) -> Optional[str]:
+    """Return the content hash of an encoded sfresult without decompressing it."""
+    if not sfresult or not sfresult.startswith(_PREFIXES):
+        return None
+    return sfresult.split(":", 3)[2]
@@ -1,7 +1,14 @@
 import os
+import threading
+import time
 import snowflake.connector
 from typing import List, Dict, Any
 
+from config import SCHEMA_CACHE_TTL_SECONDS
+
+_schema_cache: Dict[str, Any] = {"details": None, "fetched_at": 0.0}
+_schema_lock = threading.Lock()
+
 def query_snowflake(query: str) -> List[Dict[str, Any]]:
     """Execute one or multiple queries on Snowflake and return structured results."""
     conn = None
@@ -77,3 +84,19 @@ def get_schema_details() -> Dict[str, List[str]]:
             cursor.close()
         if conn:
             conn.close()
+
+
+def get_cached_schema_details(ttl: int = SCHEMA_CACHE_TTL_SECONDS) -> Dict[str, List[str]]:
+    """Return schema details, re-fetching from Snowflake only when the cached copy is older than ttl."""
+    with _schema_lock:
+        details = _schema_cache["details"]
+        if details is None or "error" in details or time.time() - _schema_cache["fetched_at"] > ttl:
+            details = get_schema_details()
+            _schema_cache["details"] = details
+            _schema_cache["fetched_at"] = time.time()
+        return details
+
+
+def prefetch_schema_details() -> None:
+    """Warm the schema cache in a background thread so it stays off the first-paint path."""
+    threading.Thread(target=get_cached_schema_details, name="schema-prefetch", daemon=True).start()